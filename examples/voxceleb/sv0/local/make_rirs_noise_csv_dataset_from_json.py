@@ -51,10 +51,10 @@ def get_chunks_list(wav_file: str,
     if split_chunks and audio_duration > chunk_duration:  # Split into pieces of self.chunk_duration seconds.
         uniq_chunks_list = get_chunks(chunk_duration, audio_id, audio_duration)
 
-        for idx, chunk in enumerate(uniq_chunks_list):
-            s, e = chunk.split("_")[-2:]  # Timestamps of start and end
-            start_sample = int(float(s) * sr)
-            end_sample = int(float(e) * sr)
+        for chunk, s, e in uniq_chunks_list:
+            # s and e are the timestamps of start and end
+            start_sample = int(s * sr)
+            end_sample = int(e * sr)
 
             # currently, all vector csv data format use one representation
             # id, duration, wav, start, stop, label
@@ -16,34 +16,180 @@ Convert the PaddleSpeech jsonline format data to csv format data in voxceleb exp
 Currently, Speaker Identificaton Training process use csv format.
 """
 import argparse
-import csv
-import json
+import logging
+import mmap
 import os
-import random
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict
 
+import numpy as np
+import pandas as pd
+import soundfile
 import tqdm
-from paddleaudio.backends import soundfile_load as load_audio
 from yacs.config import CfgNode
 
-from paddlespeech.s2t.utils.log import Log
-from paddlespeech.vector.utils.vector_utils import get_chunks
+from paddlespeech.vector.utils.vector_utils import get_batch_chunks
 
-logger = Log(__name__).getlog()
+try:
+    # orjson is much faster than the builtin json to decode the jsonline
+    import orjson as json
+except ImportError:
+    import json
 
+# the paddlespeech.s2t logger imports paddle, which is not needed in the data prepare
+logger = logging.getLogger(__name__)
 
-def prepare_csv(wav_files, output_file, config, split_chunks=True):
-    """Prepare the csv file according the wav files
+# the wav format tag of integer pcm, float pcm and extensible pcm
+WAV_PCM_FORMATS = (0x0001, 0x0003, 0xFFFE)
+
+
+@dataclass
+class Records:
+    """the utterance records parsed from the jsonline manifest, stored by column
+    Args:
+        utt (np.ndarray): the utterance names
+        utt2spk (np.ndarray): the speaker names of the utterances
+        feat (np.ndarray): the wav file paths
+        duration (np.ndarray): the total utterance time, which is feat_shape[0]
+    """
+    utt: np.ndarray
+    utt2spk: np.ndarray
+    feat: np.ndarray
+    duration: np.ndarray
+
+    def __len__(self):
+        return len(self.utt)
+
+    def take(self, idx):
+        """Get the sub records by the index array
+
+        Args:
+            idx (np.ndarray): the index of the sub records
+
+        Returns:
+            Records: the sub records
+        """
+        return Records(
+            utt=self.utt[idx],
+            utt2spk=self.utt2spk[idx],
+            feat=self.feat[idx],
+            duration=self.duration[idx])
+
+    @classmethod
+    def concat(cls, records_list):
+        """Concatenate the records list to one records
+
+        Args:
+            records_list (List[Records]): the records to concatenate
+
+        Returns:
+            Records: the concatenated records
+        """
+        return cls(utt=np.concatenate([r.utt for r in records_list]),
+                   utt2spk=np.concatenate([r.utt2spk for r in records_list]),
+                   feat=np.concatenate([r.feat for r in records_list]),
+                   duration=np.concatenate([r.duration for r in records_list]))
+
+
+def read_wav_num_frames(wav_file):
+    """Get the number of sample points from the RIFF header of the PCM wav file.
+       We only read the chunk headers until the data chunk,
+       and do not open the audio by the audio decoder.
 
     Args:
-        wav_files (list): all the audio list to prepare the csv file
+        wav_file (str): the audio file path
+
+    Returns:
+        int: the number of sample points, or None if the file is not a PCM wav file
+    """
+    with open(wav_file, 'rb') as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            return None
+        block_align = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size + (chunk_size & 1))
+                if len(fmt) < 16:
+                    return None
+                format_tag, _, _, _, block_align = struct.unpack('<HHIIH',
+                                                                 fmt[:14])
+                if format_tag not in WAV_PCM_FORMATS or block_align == 0:
+                    return None
+            elif chunk_id == b'data':
+                # the streaming wav file may not set the data chunk size
+                if block_align is None or chunk_size == 0xFFFFFFFF:
+                    return None
+                return chunk_size // block_align
+            else:
+                # the chunk is padded to the even size
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def get_num_frames(wav_file):
+    """Get the number of sample points of the audio file.
+       We only read the audio header, and decode the whole audio
+       only if the header can not be parsed.
+
+    Args:
+        wav_file (str): the audio file path
+
+    Returns:
+        int: the number of sample points in the audio file
+    """
+    num_frames = read_wav_num_frames(wav_file)
+    if num_frames is not None:
+        return num_frames
+    try:
+        return soundfile.info(wav_file).frames
+    except RuntimeError:
+        # paddleaudio imports paddle, so we only import it in the rare case
+        from paddleaudio.backends import soundfile_load as load_audio
+        waveform, _ = load_audio(wav_file)
+        return waveform.shape[0]
+
+
+def get_chunks_columns(audio_ids, durations, sr, chunk_duration=3.0):
+    """Get all the utterance segment columns of the csv file.
+       If the utterance is split into multi-chunks segments,
+       each segment is a row in the csv file.
+       We compute the segment points of all the utterances at once by numpy.
+
+    Args:
+        audio_ids (List[str]): the utterance names without the wav suffix
+        durations (np.ndarray): the total utterance time
+        sr (int): the sample rate of the audio
+        chunk_duration (float): the chunk duration. 
+
+    Returns:
+        Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]: 
+            the segment names, start points and stop points of all the segments,
+            and the segment number of each utterance
+    """
+    chunk_ids, starts_sec, ends_sec, num_chunks = get_batch_chunks(
+        chunk_duration, audio_ids, durations)
+    start_samples = (starts_sec * sr).astype(np.int64)
+    end_samples = (ends_sec * sr).astype(np.int64)
+    return chunk_ids, start_samples, end_samples, num_chunks
+
+
+def prepare_csv(records, output_file, config, split_chunks=True):
+    """Prepare the csv file according the utterance records
+
+    Args:
+        records (Records): all the utterance records to prepare the csv file
         output_file (str): the output csv file
-        config (CfgNode): yaml configuration content
+        config (CfgNode): yaml configuration content, 
+                          the config.sr is the sample rate of all the audio
         split_chunks (bool, optional): audio split flag. Defaults to True.
     """
-    if not os.path.exists(os.path.dirname(output_file)):
-        os.makedirs(os.path.dirname(output_file))
-    csv_lines = []
-    header = ["utt_id", "duration", "wav", "start", "stop", "label"]
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
     # voxceleb meta info for each training utterance segment
     # we extract a segment from a utterance to train 
     # and the segment' period is between start and stop time point in the original wav file
@@ -55,42 +201,117 @@ def prepare_csv(wav_files, output_file, config, split_chunks=True):
     # stop: stop point in the original wav file sample point range
     # label: the utterance segment's label name, 
     #        which is speaker name in speaker verification domain
-    for item in tqdm.tqdm(wav_files, total=len(wav_files)):
-        item = json.loads(item.strip())
-        audio_id = item['utt'].replace(".wav",
-                                       "")  # we remove the wav suffix name
-        audio_duration = item['feat_shape'][0]
-        wav_file = item['feat']
-        label = audio_id.split('-')[
-            0]  # speaker name in speaker verification domain
-        waveform, sr = load_audio(wav_file)
-        if split_chunks:
-            uniq_chunks_list = get_chunks(config.chunk_duration, audio_id,
-                                          audio_duration)
-            for chunk in uniq_chunks_list:
-                s, e = chunk.split("_")[-2:]  # Timestamps of start and end
-                start_sample = int(float(s) * sr)
-                end_sample = int(float(e) * sr)
-                # id, duration, wav, start, stop, label
-                # in vector, the label in speaker id
-                csv_lines.append([
-                    chunk, audio_duration, wav_file, start_sample, end_sample,
-                    label
-                ])
-        else:
-            csv_lines.append([
-                audio_id, audio_duration, wav_file, 0, waveform.shape[0], label
-            ])
-
-    with open(output_file, mode="w") as csv_f:
-        csv_writer = csv.writer(
-            csv_f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        csv_writer.writerow(header)
-        for line in csv_lines:
-            csv_writer.writerow(line)
-
-
-def get_enroll_test_list(dataset_list, verification_file):
+    # we remove the wav suffix name
+    audio_ids = [utt.replace(".wav", "") for utt in records.utt.tolist()]
+    # speaker name in speaker verification domain
+    labels = np.array(
+        [audio_id.split('-')[0] for audio_id in audio_ids], dtype=object)
+    if split_chunks:
+        # all the voxceleb audio have the same sample rate,
+        # so we get the sr from config and do not decode the audio
+        utt_ids, starts, stops, num_chunks = get_chunks_columns(
+            audio_ids,
+            records.duration,
+            sr=config.sr,
+            chunk_duration=config.chunk_duration)
+        durations = np.repeat(records.duration, num_chunks)
+        wavs = np.repeat(records.feat, num_chunks)
+        labels = np.repeat(labels, num_chunks)
+    else:
+        # each utterance is independent, so we read the audio header in multi-process
+        # and we only refresh the progress bar about 200 times in total
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            stops = list(
+                tqdm.tqdm(
+                    executor.map(get_num_frames, records.feat, chunksize=256),
+                    total=len(records),
+                    miniters=max(1, len(records) // 200),
+                    mininterval=1.0,
+                    smoothing=0))
+        utt_ids = audio_ids
+        durations = records.duration
+        wavs = records.feat
+        starts = np.zeros(len(records), dtype=np.int64)
+
+    # id, duration, wav, start, stop, label
+    # in vector, the label in speaker id
+    # pandas writes the csv file by chunks in the c writer
+    pd.DataFrame({
+        "utt_id": utt_ids,
+        "duration": durations,
+        "wav": wavs,
+        "start": starts,
+        "stop": stops,
+        "label": labels,
+    }).to_csv(
+        output_file, index=False, header=True, chunksize=200000)
+
+
+def read_jsonlines(dataset):
+    """Read all the jsonlines from the dataset file.
+       We map the file into memory and find all the line break by numpy,
+       which is much faster than the python line iterator for the large manifest.
+
+    Args:
+        dataset (str): the jsonline dataset file
+
+    Yields:
+        bytes: the non-empty jsonline in the dataset file,
+               the json decoder accepts the bytes, so we do not decode them to str
+    """
+    with open(dataset, 'rb') as f:
+        # the empty file can not be mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            buf = np.frombuffer(mm, dtype=np.uint8)
+            ends = np.flatnonzero(buf == ord('\n')).tolist()
+            # the buffer must be released before the mmap is closed
+            del buf
+            if not ends or ends[-1] != len(mm) - 1:
+                ends.append(len(mm))
+            start = 0
+            for end in ends:
+                line = mm[start:end].strip()
+                if line:
+                    yield line
+                start = end + 1
+
+
+def scan_manifests(dataset_list) -> Dict[str, Records]:
+    """Read and parse all the jsonline manifests.
+       Each manifest is only read and parsed once,
+       even if it is both in the train and test dataset list.
+
+    Args:
+        dataset_list (list): all the jsonline manifests
+
+    Returns:
+        Dict[str, Records]: the manifest path to its utterance records
+    """
+    manifests = {}
+    for dataset in dataset_list:
+        if dataset in manifests:
+            continue
+        logger.info(f"scan the manifest: {dataset}")
+        # we only keep the needed fields of each decoded line,
+        # so the decoded dict and the line are released as soon as possible
+        utts, utt2spks, feats, durations = [], [], [], []
+        for line in read_jsonlines(dataset):
+            item = json.loads(line)
+            utts.append(item['utt'])
+            utt2spks.append(item['utt2spk'])
+            feats.append(item['feat'])
+            durations.append(item['feat_shape'][0])
+        manifests[dataset] = Records(
+            utt=np.array(utts, dtype=object),
+            utt2spk=np.array(utt2spks, dtype=object),
+            feat=np.array(feats, dtype=object),
+            duration=np.array(durations, dtype=np.float64))
+    return manifests
+
+
+def get_enroll_test_list(records, verification_file):
     """Get the enroll and test utterance list from all the voxceleb1 test utterance dataset.
        Generally, we get the enroll and test utterances from the verfification file.
        The verification file format as follows:
@@ -100,7 +321,7 @@ def get_enroll_test_list(dataset_list, verification_file):
        1 a.wav a.wav
 
     Args:
-        dataset_list (list): all the dataset to get the test utterances
+        records (Records): all the test utterance records
         verification_file (str): voxceleb1 trial file
     """
     logger.info(f"verification file: {verification_file}")
@@ -112,66 +333,62 @@ def get_enroll_test_list(dataset_list, verification_file):
             enroll_audios.add('-'.join(enroll_file.split('/')))
             test_audios.add('-'.join(test_file.split('/')))
 
-    enroll_files = []
-    test_files = []
-    for dataset in dataset_list:
-        with open(dataset, 'r') as f:
-            for line in f:
-                # audio_id may be in enroll and test at the same time
-                # eg: 1 a.wav a.wav
-                # the audio a.wav is enroll and test file at the same time
-                audio_id = json.loads(line.strip())['utt']
-                if audio_id in enroll_audios:
-                    enroll_files.append(line)
-                if audio_id in test_audios:
-                    test_files.append(line)
-
-    enroll_files = sorted(enroll_files)
-    test_files = sorted(test_files)
+    # audio_id may be in enroll and test at the same time
+    # eg: 1 a.wav a.wav
+    # the audio a.wav is enroll and test file at the same time
+    # pandas checks the membership of all the utterances in its c hash table
+    utts = pd.Series(records.utt, dtype=object)
+    enroll_idx = np.flatnonzero(utts.isin(enroll_audios).to_numpy())
+    test_idx = np.flatnonzero(utts.isin(test_audios).to_numpy())
+
+    # sort the utterances by the utterance name
+    enroll_idx = enroll_idx[np.argsort(records.utt[enroll_idx], kind="stable")]
+    test_idx = test_idx[np.argsort(records.utt[test_idx], kind="stable")]
+    enroll_files = records.take(enroll_idx)
+    test_files = records.take(test_idx)
 
     return enroll_files, test_files
 
 
-def get_train_dev_list(dataset_list, target_dir, split_ratio):
+def get_train_dev_list(records, target_dir, split_ratio, seed=0):
     """Get the train and dev utterance list from all the training utterance dataset.
        Generally, we use the split_ratio as the train dataset ratio,
        and the remaining utterance (ratio is 1 - split_ratio) is the dev dataset
 
     Args:
-        dataset_list (list): all the dataset to get the all utterances
+        records (Records): all the train utterance records
         target_dir (str): the target train and dev directory, 
                           we will create the csv directory to store the {train,dev}.csv file
         split_ratio (float): train dataset ratio in all utterance list
+        seed (int, optional): the random seed to shuffle the utterance list. Defaults to 0.
     """
     logger.info("start to get train and dev utt list")
-    if not os.path.exists(os.path.join(target_dir, "meta")):
-        os.makedirs(os.path.join(target_dir, "meta"))
+    os.makedirs(os.path.join(target_dir, "meta"), exist_ok=True)
 
-    audio_files = []
-    speakers = set()
-    for dataset in dataset_list:
-        with open(dataset, 'r') as f:
-            for line in f:
-                # the label is speaker name
-                label_name = json.loads(line.strip())['utt2spk']
-                speakers.add(label_name)
-                audio_files.append(line.strip())
-    speakers = sorted(speakers)
+    # the label is speaker name
+    # the training classifier uses the label id directly,
+    # so we sort the speakers to keep the label id stable whatever the manifest order is
+    speakers = np.unique(records.utt2spk).tolist()
     logger.info(f"we get {len(speakers)} speakers from all the train dataset")
 
     with open(os.path.join(target_dir, "meta", "label2id.txt"), 'w') as f:
-        for label_id, label_name in enumerate(speakers):
-            f.write(f'{label_name} {label_id}\n')
+        f.writelines(f'{label_name} {label_id}\n'
+                     for label_id, label_name in enumerate(speakers))
     logger.info(
         f'we store the speakers to {os.path.join(target_dir, "meta", "label2id.txt")}'
     )
 
     # the split_ratio is for train dataset 
     # the remaining is for dev dataset
-    split_idx = int(split_ratio * len(audio_files))
-    audio_files = sorted(audio_files)
-    random.shuffle(audio_files)
-    train_files, dev_files = audio_files[:split_idx], audio_files[split_idx:]
+    # the manifest order depends on the filesystem, so we sort the utterance names
+    # to get a canonical order, and then permute it with the seed,
+    # which makes the train and dev split deterministic on different machines
+    split_idx = int(split_ratio * len(records))
+    order = np.argsort(records.utt, kind="stable")
+    rng = np.random.default_rng(seed)
+    idx = order[rng.permutation(len(records))]
+    train_files = records.take(idx[:split_idx])
+    dev_files = records.take(idx[split_idx:])
     logger.info(
         f"we get train utterances: {len(train_files)}, dev utterance: {len(dev_files)}"
     )
@@ -185,9 +402,6 @@ def prepare_data(args, config):
         args (argparse.Namespace): scripts args
         config (CfgNode): yaml configuration content
     """
-    # stage0: set the random seed
-    random.seed(config.seed)
-
     # if external config set the skip_prep flat, we will do nothing
     if config.skip_prep:
         return
@@ -195,16 +409,20 @@ def prepare_data(args, config):
     # stage 1: prepare the enroll and test csv file
     #          And we generate the speaker to label file label2id.txt
     logger.info("start to prepare the data csv file")
+    csv_dir = os.path.join(args.target_dir, "csv")
+    # the test manifest may be in the train manifests,
+    # so we scan all the manifests only once
+    manifests = scan_manifests([args.test] + args.train)
     enroll_files, test_files = get_enroll_test_list(
-        [args.test], verification_file=config.verification_file)
+        manifests[args.test], verification_file=config.verification_file)
     prepare_csv(
         enroll_files,
-        os.path.join(args.target_dir, "csv", "enroll.csv"),
+        os.path.join(csv_dir, "enroll.csv"),
         config,
         split_chunks=False)
     prepare_csv(
         test_files,
-        os.path.join(args.target_dir, "csv", "test.csv"),
+        os.path.join(csv_dir, "test.csv"),
         config,
         split_chunks=False)
 
@@ -212,12 +430,15 @@ def prepare_data(args, config):
     #          we get the train dataset ratio as config.split_ratio
     #          and the remaining is dev dataset
     logger.info("start to prepare the data csv file")
+    train_records = Records.concat(
+        [manifests[dataset] for dataset in args.train])
     train_files, dev_files = get_train_dev_list(
-        args.train, target_dir=args.target_dir, split_ratio=config.split_ratio)
-    prepare_csv(train_files,
-                os.path.join(args.target_dir, "csv", "train.csv"), config)
-    prepare_csv(dev_files,
-                os.path.join(args.target_dir, "csv", "dev.csv"), config)
+        train_records,
+        target_dir=args.target_dir,
+        split_ratio=config.split_ratio,
+        seed=config.seed)
+    prepare_csv(train_files, os.path.join(csv_dir, "train.csv"), config)
+    prepare_csv(dev_files, os.path.join(csv_dir, "dev.csv"), config)
 
 
 if __name__ == "__main__":
@@ -242,6 +463,11 @@ if __name__ == "__main__":
         help="configuration file")
     args = parser.parse_args()
 
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] [%(filename)s:%(lineno)d] %(message)s',
+        datefmt='[%Y-%m-%d %H:%M:%S]')
+
     # parse the yaml config file
     config = CfgNode(new_allowed=True)
     if args.config:
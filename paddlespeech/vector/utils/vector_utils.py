@@ -11,7 +11,36 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import paddle
+import numpy as np
+
+
+def get_batch_chunks(seg_dur, audio_ids, audio_durations):
+    """Get all chunk segments from multi utterances at once
+
+    Args:
+        seg_dur (float): segment chunk duration, seconds
+        audio_ids (List[str]): utterance names
+        audio_durations (np.ndarray): utterance durations, seconds
+
+    Returns:
+        Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]: 
+            the chunk ids, start seconds and end seconds of all the chunk segments,
+            and the number of chunk segments of each utterance
+    """
+    audio_durations = np.asarray(audio_durations)
+    num_chunks = (audio_durations / seg_dur).astype(np.int64)  # all in seconds
+    # the chunk index in its utterance
+    first_chunk = np.cumsum(num_chunks) - num_chunks
+    chunk_idx = np.arange(num_chunks.sum()) - np.repeat(first_chunk, num_chunks)
+    starts = chunk_idx * seg_dur
+    ends = starts + seg_dur
+    chunk_ids = [
+        f"{audio_id}_{s}_{e}"
+        for audio_id, s, e in zip(
+            np.repeat(np.array(audio_ids, dtype=object), num_chunks).tolist(),
+            starts.tolist(), ends.tolist())
+    ]
+    return chunk_ids, starts, ends, num_chunks
 
 
 def get_chunks(seg_dur, audio_id, audio_duration):
@@ -23,19 +52,21 @@ def get_chunks(seg_dur, audio_id, audio_duration):
         audio_duration (float): utterance duration, seconds
 
     Returns:
-        List: all the chunk segments 
+        List[Tuple[str, float, float]]: all the chunk segments,
+            each item is (chunk id, start seconds, end seconds)
     """
-    num_chunks = int(audio_duration / seg_dur)  # all in seconds
-    chunk_lst = [
-        audio_id + "_" + str(i * seg_dur) + "_" + str(i * seg_dur + seg_dur)
-        for i in range(num_chunks)
-    ]
+    chunk_ids, starts, ends, _ = get_batch_chunks(seg_dur, [audio_id],
+                                                  [audio_duration])
+    chunk_lst = list(zip(chunk_ids, starts.tolist(), ends.tolist()))
     return chunk_lst
 
 
 def Q_from_tokens(token_num):
     """Get prior model, data from uniform, would support others(guassian) in future
     """
+    # get_chunks is used in the cpu data prepare scripts,
+    # so we only import paddle when we need the tensor
+    import paddle
     freq = [1] * token_num
     Q = paddle.to_tensor(freq, dtype='float64')
     return Q / Q.sum()
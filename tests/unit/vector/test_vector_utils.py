@@ -0,0 +1,56 @@
+# Copyright (c) 2022 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+def test_get_chunks():
+    from paddlespeech.vector.utils.vector_utils import get_chunks
+
+    seg_dur = 3.0
+    chunks = get_chunks(seg_dur, "id10001-1zcIwhmdeo4-00001", 7.5)
+    assert chunks == [
+        ("id10001-1zcIwhmdeo4-00001_0.0_3.0", 0.0, 3.0),
+        ("id10001-1zcIwhmdeo4-00001_3.0_6.0", 3.0, 6.0),
+    ]
+
+    # the chunk id keeps the format of audio_id + "_" + start + "_" + end
+    old_chunk_ids = [
+        "id10001-1zcIwhmdeo4-00001" + "_" + str(i * seg_dur) + "_" +
+        str(i * seg_dur + seg_dur) for i in range(int(7.5 / seg_dur))
+    ]
+    assert [chunk for chunk, _, _ in chunks] == old_chunk_ids
+
+    # the utterance shorter than the segment has no chunk
+    assert get_chunks(seg_dur, "id10001-1zcIwhmdeo4-00002", 2.9) == []
+
+
+def test_get_batch_chunks():
+    from paddlespeech.vector.utils.vector_utils import get_batch_chunks
+    from paddlespeech.vector.utils.vector_utils import get_chunks
+
+    audio_ids = ["id10001-a-00001", "id10001-a-00002", "id10002-b-00001"]
+    audio_durations = [7.5, 2.9, 3.0]
+    chunk_ids, starts, ends, num_chunks = get_batch_chunks(3.0, audio_ids,
+                                                           audio_durations)
+    assert num_chunks.tolist() == [2, 0, 1]
+    # the batch chunks are the same as the chunks of each utterance
+    assert list(zip(chunk_ids, starts.tolist(), ends.tolist())) == [
+        chunk
+        for audio_id, audio_duration in zip(audio_ids, audio_durations)
+        for chunk in get_chunks(3.0, audio_id, audio_duration)
+    ]
+    assert chunk_ids == [
+        "id10001-a-00001_0.0_3.0",
+        "id10001-a-00001_3.0_6.0",
+        "id10002-b-00001_0.0_3.0",
+    ]